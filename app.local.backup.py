@@ -1,161 +1,256 @@
 from flask import Flask, render_template, request, jsonify, session
-import os, threading, re, ast, operator
+import hashlib, logging, os, queue, re, operator, threading, time, uuid
+from concurrent.futures import Future
+from functools import lru_cache
+from cachetools import LRUCache
+import orjson
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger("chat")
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-key")
 
 # -------------------------------
-# Model (lazy-loaded for fast startup)
+# Model (loaded once on a background thread, so startup and requests never
+# wait on it; /chat answers 503 until MODEL_READY is set, or for good if
+# loading failed and MODEL_ERROR says why)
 # -------------------------------
 MODEL_NAME = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
-tokenizer = None
-model = None
-model_lock = threading.Lock()
-model_ready = False
+# bf16 halves weight bandwidth vs fp32; set MODEL_DTYPE=float32 on CPUs without bf16 support
+MODEL_DTYPE = os.environ.get("MODEL_DTYPE", "bfloat16")
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE") == "1"
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", os.cpu_count() or 4))
 
 SYSTEM_PROMPT = (
     "You are a helpful, concise assistant for a beginner-friendly Python web app. "
     "Answer clearly, use short paragraphs, and avoid making things up. "
     "If you are unsure, say so briefly."
 )
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+HISTORY_MAX = 10
+PREFIX_SESSIONS_MAX = 1024
 
-def ensure_model_loaded():
-    """Load the tokenizer + model once, on demand."""
-    global tokenizer, model, model_ready
-    if model_ready:
+# Intra-op threads do the matmuls; a single generate loop gains nothing from
+# inter-op parallelism. Must be set before torch runs any parallel work.
+torch.set_num_threads(TORCH_THREADS)
+torch.set_num_interop_threads(1)
+
+tokenizer = None
+model = None
+MODEL_READY = threading.Event()
+MODEL_ERROR = None
+
+def _load_model():
+    global MODEL_ERROR
+    try:
+        _load_weights()
+    except Exception as e:
+        log.exception("model load failed")
+        MODEL_ERROR = f"{type(e).__name__}: {e}"
         return
-    with model_lock:
-        if model_ready:
-            return
-        tok = AutoTokenizer.from_pretrained(MODEL_NAME)
-        mdl = AutoModelForCausalLM.from_pretrained(
-            MODEL_NAME,
-            dtype=torch.float32,   # CPU-friendly
-            device_map="auto"      # CPU unless you have a GPU
-        )
-        mdl.eval()
-        tokenizer = tok
-        model = mdl
-        model_ready = True
+    # The batch worker only exists once there is a model to run
+    threading.Thread(target=_generate_worker, daemon=True).start()
+    MODEL_READY.set()
+
+def _load_weights():
+    global tokenizer, model
+    tok = AutoTokenizer.from_pretrained(MODEL_NAME)
+    m = AutoModelForCausalLM.from_pretrained(
+        MODEL_NAME,
+        dtype=getattr(torch, MODEL_DTYPE),   # a bad name fails the load, not the import
+        device_map="auto"      # CPU unless you have a GPU
+    )
+    m.eval()
+    # Batched prompts are padded on the left so generation starts at the same column
+    tok.padding_side = "left"
+    if tok.pad_token is None:
+        tok.pad_token = tok.eos_token
+    if TORCH_COMPILE:
+        # Compile forward only; generate() stays the regular HF loop around it
+        m.forward = torch.compile(m.forward, mode="reduce-overhead", fullgraph=False)
+    tokenizer, model = tok, m
+    _init_prefix_reuse()
 
 # -------------------------------
 # Math guardrail (robust)
-# - Finds the longest arithmetic substring inside any sentence
+# - Condenses any sentence down to its arithmetic expression
 # - Normalizes word operators and unicode symbols
 # - Safely evaluates + - * / ^ and parentheses
 # -------------------------------
-_ALLOWED_OPS = {
-    ast.Add: operator.add,
-    ast.Sub: operator.sub,
-    ast.Mult: operator.mul,
-    ast.Div: operator.truediv,
-    ast.Pow: operator.pow,   # remove if you don't want exponentiation
-    ast.USub: operator.neg,
-    ast.UAdd: operator.pos,
-}
 _MATH_CHARS = "0123456789+-*/^(). "
 _MATH_RE = re.compile(r"^[0-9+\-*/^().\s]+$")
+_EXPR_CHARS = frozenset(_MATH_CHARS.replace(" ", ""))
+_OP_CHARS = frozenset("+-*/^")
+
+# Every byte that is not a math character; bytes.translate deletes them all
+# in a single C-level pass
+_MATH_DELETE = bytes(i for i in range(256) if chr(i) not in _EXPR_CHARS)
+
+_DIGIT_RE = re.compile(r"[0-9]")
+_UNICODE_OPS = str.maketrans({
+    "×": "*",
+    "·": "*",
+    "÷": "/",
+    "–": "-",   # en-dash
+    "—": "-",   # em-dash
+})
+_WORD_OP_MAP = {
+    "divided by": "/",
+    "multiplied by": "*",
+    "over": "/",
+    "times": "*",
+    "plus": "+",
+    "minus": "-",
+    "x": "*",
+}
+# No letter may touch a word operator, so "moreover" or "next" no longer leak
+# operators while glued forms like "2x3", "2times3" or "10over2" still work
+_WORD_OP_RE = re.compile(
+    r"(?<![a-z])(?:divided by|multiplied by|over|times|plus|minus|x)(?![a-z])"
+)
+
+# Expressions compile to a flat RPN program via shunting-yard, so evaluation
+# is a loop over a list instead of a walk over a parse tree
+# Integer powers beyond this many result bits are refused before computing,
+# so something like 9^9^9 falls back to the model instead of pinning a CPU
+_POW_MAX_BITS = 4096
+
+def _bounded_pow(a, b):
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and a.bit_length() * b > _POW_MAX_BITS:
+        raise ValueError("Result too large")
+    try:
+        return operator.pow(a, b)
+    except OverflowError:   # float powers past the double range
+        raise ValueError("Result too large") from None
+
+_TOKEN_RE = re.compile(r"(\d+\.?\d*|\.\d+)|(\*\*|[-+*/^()])|(\S)")
+_BINARY_OPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "^": _bounded_pow,   # remove if you don't want exponentiation
+}
+_UNARY_OPS = {"-": operator.neg, "+": operator.pos}
+# A sign binds looser than ^ on its right, so -2^2 == -4 like Python's -2**2
+_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2, "u-": 3, "u+": 3, "^": 4}
 
-_WORD_TO_OP = [
-    ("divided by", "/"),
-    ("over", "/"),
-    ("times", "*"),
-    ("multiplied by", "*"),
-    ("x", "*"),
-    ("×", "*"),
-    ("·", "*"),
-    ("plus", "+"),
-    ("minus", "-"),
-    ("–", "-"),   # en-dash
-    ("—", "-"),   # em-dash
-    ("÷", "/"),
-]
-
-def _eval_node(node):
-    if isinstance(node, ast.Expression):
-        return _eval_node(node.body)
-    if isinstance(node, ast.Constant):  # Py3.8+
-        if isinstance(node.value, (int, float)):
-            return node.value
-        raise ValueError("Invalid constant")
-    if isinstance(node, ast.Num):       # legacy (<3.8)
-        return node.n
-    if isinstance(node, ast.UnaryOp) and type(node.op) in _ALLOWED_OPS:
-        return _ALLOWED_OPS[type(node.op)](_eval_node(node.operand))
-    if isinstance(node, ast.BinOp) and type(node.op) in _ALLOWED_OPS:
-        left = _eval_node(node.left)
-        right = _eval_node(node.right)
-        return _ALLOWED_OPS[type(node.op)](left, right)
-    raise ValueError("Unsupported expression")
+def _rpn_op(sym):
+    return ("u", sym[1]) if sym[0] == "u" else ("b", sym)
 
+def _to_rpn(expr: str):
+    out, ops = [], []
+    expect_operand = True
+    for num, op, bad in _TOKEN_RE.findall(expr):
+        if bad:
+            raise ValueError("Unsupported character")
+        if num:
+            if not expect_operand:
+                raise ValueError("Missing operator")
+            out.append(("n", float(num) if "." in num else int(num)))
+            expect_operand = False
+        elif op == "(":
+            if not expect_operand:
+                raise ValueError("Missing operator")
+            ops.append(op)
+        elif op == ")":
+            if expect_operand:
+                raise ValueError("Missing operand")
+            while ops and ops[-1] != "(":
+                out.append(_rpn_op(ops.pop()))
+            if not ops:
+                raise ValueError("Unbalanced parentheses")
+            ops.pop()
+        elif expect_operand:
+            if op not in _UNARY_OPS:
+                raise ValueError("Missing operand")
+            # Prefix signs never pop anything; they wait for their operand
+            ops.append("u" + op)
+        else:
+            op = "^" if op == "**" else op
+            prec = _PRECEDENCE[op]
+            while ops and ops[-1] != "(" and (
+                _PRECEDENCE[ops[-1]] > prec
+                or (_PRECEDENCE[ops[-1]] == prec and op != "^")   # ^ is right-associative
+            ):
+                out.append(_rpn_op(ops.pop()))
+            ops.append(op)
+            expect_operand = True
+    if expect_operand:
+        raise ValueError("Incomplete expression")
+    while ops:
+        sym = ops.pop()
+        if sym == "(":
+            raise ValueError("Unbalanced parentheses")
+        out.append(_rpn_op(sym))
+    return tuple(out)
+
+def _eval_rpn(rpn):
+    stack = []
+    for kind, val in rpn:
+        if kind == "n":
+            stack.append(val)
+        elif kind == "u":
+            stack.append(_UNARY_OPS[val](stack.pop()))
+        else:
+            b = stack.pop()
+            a = stack.pop()
+            stack.append(_BINARY_OPS[val](a, b))
+    return stack[0]
+
+@lru_cache(maxsize=4096)
 def safe_eval_expr(expr: str):
+    """Compile and evaluate; repeats are answered from the cache."""
     if not _MATH_RE.fullmatch(expr):
         raise ValueError("Unsafe characters")
-    tree = ast.parse(expr, mode="eval")
-    val = _eval_node(tree)
+    val = _eval_rpn(_to_rpn(expr))
     return int(val) if isinstance(val, float) and val.is_integer() else val
 
-def normalize_sentence_to_math(text: str) -> str:
-    """Convert any sentence to a condensed arithmetic expression candidate."""
-    s = text.lower()
+def _extract_math_expression(user_text: str) -> str:
+    """
+    Full pipeline: sentence -> condensed arithmetic expression.
+    Word operators are mapped, non-math characters and spaces are dropped,
+    and the result is kept only if it contains at least one operator.
+    Returns "" if nothing reasonable is found.
+    """
+    # Cheap tests first: no digit, or no operator symbol/word, means no math
+    if not _DIGIT_RE.search(user_text):
+        return ""
+    s = user_text.lower().translate(_UNICODE_OPS)
+    if _OP_CHARS.isdisjoint(s) and not _WORD_OP_RE.search(s):
+        return ""
 
     # If there's an equals sign, keep only the left side (ignore asserted result)
     if "=" in s:
         s = s.split("=", 1)[0]
 
-    # Replace common word operators and unicode symbols
-    for word, op in _WORD_TO_OP:
-        s = s.replace(word, op)
+    # Replace common word operators (unicode symbols were mapped above)
+    s = _WORD_OP_RE.sub(lambda m: _WORD_OP_MAP[m.group(0)], s)
 
-    # Remove quotes/letters/commas etc., keep mathy chars + spaces
-    s = "".join(ch for ch in s if ch in _MATH_CHARS)
+    # Remove quotes/letters/commas/spaces etc., keep mathy chars only
+    # (anything outside latin-1 is dropped by the encode itself)
+    s = s.encode("latin-1", "ignore").translate(None, _MATH_DELETE).decode("ascii")
+    return "" if _OP_CHARS.isdisjoint(s) else s
 
-    # Collapse spaces
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def longest_math_substring(text: str) -> str:
-    """
-    From a normalized string (only math-ish chars), pick the longest substring
-    that contains at least one operator and parses our allowed pattern.
-    """
-    # Split on non-math chars just in case (shouldn't exist after normalize)
-    candidates = re.findall(r"[0-9+\-*/^(). ]+", text)
-    # Clean and score by length
-    cleaned = []
-    for c in candidates:
-        c2 = c.replace(" ", "")
-        if not c2:
-            continue
-        if _MATH_RE.fullmatch(c2) and re.search(r"[+\-*/^]", c2):
-            cleaned.append(c2)
-    if not cleaned:
-        return ""
-    # Pick the longest; if tie, last occurrence (usually the main expression)
-    cleaned.sort(key=len)
-    return cleaned[-1]
+# Only short messages are memoized: long ones rarely repeat and would just
+# push the common short inputs out of the cache
+_MATH_CACHE_MAXLEN = 200
+_extract_math_cached = lru_cache(maxsize=1024)(_extract_math_expression)
 
 def extract_math_expression(user_text: str) -> str:
-    """
-    Full pipeline: sentence -> normalized -> longest arithmetic substring.
-    Returns "" if nothing reasonable is found.
-    """
-    normalized = normalize_sentence_to_math(user_text)
-    expr = longest_math_substring(normalized)
-    return expr
+    if len(user_text) <= _MATH_CACHE_MAXLEN:
+        return _extract_math_cached(user_text)
+    return _extract_math_expression(user_text)
 
 # -------------------------------
 # Chat helpers
 # -------------------------------
 def to_chat_messages(history, user_text):
-    msgs = [{"role": "system", "content": SYSTEM_PROMPT}]
-    for m in history:
-        role = "assistant" if m["role"] == "bot" else "user"
-        msgs.append({"role": role, "content": m["text"]})
-    msgs.append({"role": "user", "content": user_text})
-    return msgs
+    # History is stored in chat-template form already, so this is a concat
+    return [SYSTEM_MSG, *history, {"role": "user", "content": user_text}]
 
 def build_inputs(history, user_text):
     msgs = to_chat_messages(history, user_text)
@@ -171,33 +266,187 @@ def build_inputs(history, user_text):
             prefix = "User:" if m["role"] == "user" else "Assistant:"
             text += f"{prefix} {m['content']}\n"
         text += "Assistant:"
-    return tokenizer(text, return_tensors="pt")
+    return tokenizer(text).input_ids
+
+# Tokenized prompt per session, kept as (digest of the stored history, ids of
+# each user/assistant exchange in it). A new turn only tokenizes its own text
+# in the TinyLlama chat format and is appended after the system block and the
+# cached exchanges; when the history is trimmed, the oldest exchanges are
+# dropped from the cache the same way, so reuse continues past HISTORY_MAX.
+_TURN_TEXT = "<|user|>\n{}</s>\n<|assistant|>\n"
+_REPLY_TEXT = "{}</s>\n"
+_prefix_ids = LRUCache(maxsize=PREFIX_SESSIONS_MAX)
+_prefix_lock = threading.Lock()
+_nl_ids = []
+_head_ids = []   # BOS + system block
+# Only turned on once a probe conversation tokenizes identically both ways
+PREFIX_REUSE = False
+
+def _encode(text):
+    """Ids for text as it tokenizes right after a newline in the full template.
+
+    SentencePiece puts a dummy "▁" piece in front of every string it encodes
+    on its own, so the text is encoded behind a newline and that is cut off.
+    """
+    ids = tokenizer("\n" + text, add_special_tokens=False).input_ids
+    return ids[len(_nl_ids):]
+
+def _exchange_ids(user_text, reply):
+    return _encode(_TURN_TEXT.format(user_text)) + _encode(_REPLY_TEXT.format(reply))
+
+def _init_prefix_reuse():
+    global _nl_ids, _head_ids, PREFIX_REUSE
+    try:
+        _nl_ids = tokenizer("\n", add_special_tokens=False).input_ids
+        _head_ids = tokenizer(tokenizer.apply_chat_template([SYSTEM_MSG], tokenize=False)).input_ids
+        user, reply, follow_up = "Hi there", "Hello! How can I help?", "What is Flask?"
+        history = [{"role": "user", "content": user}, {"role": "assistant", "content": reply}]
+        PREFIX_REUSE = (
+            _head_ids + _encode(_TURN_TEXT.format(user)) == build_inputs([], user)
+            and _head_ids + _exchange_ids(user, reply) + _encode(_TURN_TEXT.format(follow_up))
+            == build_inputs(history, follow_up)
+        )
+    except Exception:
+        log.exception("tokenized prefix probe failed")
+        PREFIX_REUSE = False
+    if not PREFIX_REUSE:
+        log.warning("tokenized prefix reuse disabled: incremental ids differ from the chat template")
+
+def _history_digest(history):
+    return hashlib.blake2b(orjson.dumps(history), digest_size=16).digest()
+
+def _split_exchanges(history):
+    """Per-exchange ids for a stored history, or None if it is not user/assistant pairs."""
+    if len(history) % 2:
+        return None
+    exchanges = []
+    for user, reply in zip(history[::2], history[1::2]):
+        if user["role"] != "user" or reply["role"] != "assistant":
+            return None
+        exchanges.append(_exchange_ids(user["content"], reply["content"]))
+    return exchanges
+
+def session_inputs(sid, history, user_text):
+    """Prompt ids for this turn, plus per-exchange ids ending with this turn's (or None)."""
+    if not PREFIX_REUSE:
+        return build_inputs(history, user_text), None
+    with _prefix_lock:
+        cached = _prefix_ids.get(sid)
+    # Matched on content, so another tab on the same sid or a math turn never
+    # reuses ids built for a different conversation
+    if cached is not None and cached[0] == _history_digest(history):
+        exchanges = list(cached[1])
+    else:
+        exchanges = _split_exchanges(history)
+        if exchanges is None:
+            return build_inputs(history, user_text), None
+    exchanges.append(_encode(_TURN_TEXT.format(user_text)))
+    ids = list(_head_ids)
+    for ex in exchanges:
+        ids += ex
+    return ids, exchanges
+
+def remember_prefix(sid, history, exchanges, reply_text):
+    """Cache exchanges for the stored `history`, which already includes this turn."""
+    if exchanges is None:
+        return
+    exchanges[-1] = exchanges[-1] + _encode(_REPLY_TEXT.format(reply_text))
+    # Drop the same leading exchanges the HISTORY_MAX trim dropped
+    exchanges = exchanges[len(exchanges) - len(history) // 2:]
+    with _prefix_lock:
+        _prefix_ids[sid] = (_history_digest(history), tuple(exchanges))
+
+def forget_prefix(sid):
+    with _prefix_lock:
+        _prefix_ids.pop(sid, None)
+
+def _session_id():
+    sid = session.get("sid")
+    if sid is None:
+        sid = session["sid"] = uuid.uuid4().hex
+    return sid
+
+def record_turn(history, user_text, reply):
+    """Append one exchange to the session history, keeping the last HISTORY_MAX messages."""
+    history.append({"role": "user", "content": user_text})
+    history.append({"role": "assistant", "content": reply})
+    history = session["history"] = history[-HISTORY_MAX:]
+    return history
+
+# -------------------------------
+# Generation (micro-batched)
+# - One background thread owns model.generate
+# - Prompts queued within BATCH_WAIT are left-padded into a single batch
+# -------------------------------
+BATCH_MAX = 8
+BATCH_WAIT = 0.01
+GENERATE_TIMEOUT = 120
+_gen_queue = queue.Queue()
+
+def _clean_reply(reply_ids):
+    reply_text = tokenizer.decode(reply_ids, skip_special_tokens=True).strip()
+    for marker in ["<|user|>", "<|assistant|>", "User:", "Assistant:"]:
+        if marker in reply_text:
+            reply_text = reply_text.split(marker)[0].strip()
+    return reply_text
 
-def generate_reply(inputs):
-    with torch.no_grad():
+def generate_batch(batch):
+    with torch.inference_mode():
         output = model.generate(
-            **inputs,
+            **batch,
             max_new_tokens=220,
             temperature=0.3,     # lower randomness
             top_p=0.9,
             repetition_penalty=1.1,
             do_sample=True,
+            use_cache=True,      # reuse the KV cache across decode steps
             eos_token_id=tokenizer.eos_token_id,
         )
-    prompt_len = inputs["input_ids"].shape[-1]
-    reply_ids = output[0][prompt_len:]
-    reply_text = tokenizer.decode(reply_ids, skip_special_tokens=True).strip()
-    for marker in ["<|user|>", "<|assistant|>", "User:", "Assistant:"]:
-        if marker in reply_text:
-            reply_text = reply_text.split(marker)[0].strip()
-    return reply_text
+    # Left padding lines every prompt up to the same length
+    prompt_len = batch["input_ids"].shape[-1]
+    return [_clean_reply(row[prompt_len:]) for row in output]
+
+def _drain_batch():
+    items = [_gen_queue.get()]
+    deadline = time.monotonic() + BATCH_WAIT
+    while len(items) < BATCH_MAX:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(_gen_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
+
+def _generate_worker():
+    while True:
+        items = _drain_batch()
+        try:
+            batch = tokenizer.pad({"input_ids": [ids for ids, _ in items]}, return_tensors="pt")
+            replies = generate_batch(batch)
+        except Exception as e:
+            for _, fut in items:
+                fut.set_exception(e)
+            continue
+        for (_, fut), reply in zip(items, replies):
+            fut.set_result(reply)
+
+def generate_reply(input_ids):
+    """Queue one prompt for the batch worker and wait for its reply."""
+    fut = Future()
+    _gen_queue.put((input_ids, fut))
+    return fut.result(timeout=GENERATE_TIMEOUT)
+
+# Started last, so everything the loader calls is already defined
+threading.Thread(target=_load_model, daemon=True).start()
 
 # -------------------------------
 # Routes
 # -------------------------------
 @app.get("/")
 def index():
-    session.setdefault("messages", [])
+    session.setdefault("history", [])
     return render_template("index.html")
 
 @app.post("/chat")
@@ -211,38 +460,39 @@ def chat():
     if expr:
         try:
             result = safe_eval_expr(expr)
-            # Debug print so you can confirm what's being evaluated
-            print(f"[math] extracted='{expr}' -> {result}")
-            msgs = session.get("messages", [])
-            msgs.append({"role": "user", "text": user_text})
-            msgs.append({"role": "bot", "text": str(result)})
-            session["messages"] = msgs[-10:]
+            # Run with LOGLEVEL=DEBUG to confirm what's being evaluated
+            log.debug("[math] extracted=%r -> %s", expr, result)
+            record_turn(session.get("history", []), user_text, str(result))
             return jsonify({"ok": True, "reply": str(result)})
         except Exception as e:
-            print(f"[math] failed to eval '{expr}': {e}  (falling back to model)")
+            log.warning("[math] failed to eval %r: %s (falling back to model)", expr, e)
 
     # --- Otherwise, fall back to model ---
-    msgs = session.get("messages", [])
-    msgs.append({"role": "user", "text": user_text})
-    if len(msgs) > 10:
-        msgs = msgs[-10:]
-
-    ensure_model_loaded()
-    inputs = build_inputs(msgs, user_text)
-    reply_text = generate_reply(inputs)
+    if not MODEL_READY.wait(0.05):
+        if MODEL_ERROR:
+            return jsonify({"ok": False, "error": "model failed to load"}), 503
+        return jsonify({"ok": False, "error": "warming"}), 503
+    sid = _session_id()
+    history = session.get("history", [])
+    input_ids, exchanges = session_inputs(sid, history, user_text)
+    reply_text = generate_reply(input_ids)
 
-    msgs.append({"role": "bot", "text": reply_text})
-    session["messages"] = msgs
+    remember_prefix(sid, record_turn(history, user_text, reply_text), exchanges, reply_text)
     return jsonify({"ok": True, "reply": reply_text})
 
 @app.post("/reset")
 def reset():
-    session.pop("messages", None)
+    session.pop("history", None)
+    forget_prefix(session.get("sid"))
     return jsonify({"ok": True})
 
 @app.get("/health")
 def health():
-    return jsonify({"status": "ok", "model_ready": model_ready})
+    return jsonify({
+        "status": "error" if MODEL_ERROR else "ok",
+        "model_ready": MODEL_READY.is_set(),
+        "model_error": MODEL_ERROR,
+    })
 
 if __name__ == "__main__":
     PORT = int(os.environ.get("PORT", "5050"))
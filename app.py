@@ -1,75 +1,430 @@
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
-import os
+from flask import Flask, Response, render_template, request, session, send_from_directory, stream_with_context
+from flask.json.provider import JSONProvider
+import hashlib, hmac, logging, os, queue, threading, time, uuid
+from collections import deque
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import timedelta
 from dotenv import load_dotenv
+from cachetools import LRUCache, TTLCache
 import cohere
+import httpx
+import orjson
 
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LOGLEVEL", "INFO"))
+log = logging.getLogger("chat")
+
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
-co = cohere.ClientV2(api_key=COHERE_API_KEY)
+COHERE_MODEL = os.getenv("COHERE_MODEL", "command-a-03-2025")
+COHERE_TIMEOUT = float(os.getenv("COHERE_TIMEOUT", "20"))
+COHERE_RETRIES = int(os.getenv("COHERE_RETRIES", "2"))
+COHERE_POOL = int(os.getenv("COHERE_POOL", "32"))
+COHERE_MAX_TOKENS = int(os.getenv("COHERE_MAX_TOKENS", "384"))
+
+# Bounds shared by every chat call, so a stuck or runaway generation cannot
+# hold a worker (or spend tokens) indefinitely
+CO_OPTS = dict(max_tokens=COHERE_MAX_TOKENS, temperature=0.3)
+REQ_OPTS = {"timeout_in_seconds": COHERE_TIMEOUT, "max_retries": COHERE_RETRIES}
+# Longest a /chat caller waits: every attempt timing out, plus the SDK's
+# backoff between retries (capped at 10 s each)
+CHAT_TIMEOUT = (COHERE_RETRIES + 1) * COHERE_TIMEOUT + COHERE_RETRIES * 10
+
+# One module-level HTTP client with keep-alive, so concurrent requests reuse
+# warm TLS connections to Cohere instead of handshaking per call
+_hx = httpx.Client(
+    limits=httpx.Limits(max_connections=COHERE_POOL, max_keepalive_connections=COHERE_POOL, keepalive_expiry=60),
+    http2=True,
+    timeout=httpx.Timeout(COHERE_TIMEOUT, connect=5),
+)
+co = cohere.ClientV2(api_key=COHERE_API_KEY, timeout=COHERE_TIMEOUT, httpx_client=_hx)
+
+def _prewarm_cohere():
+    try:
+        _hx.head("https://api.cohere.com/")
+    except httpx.HTTPError:
+        pass
+
+threading.Thread(target=_prewarm_cohere, daemon=True).start()
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, used by get_json and the session cookie."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__, template_folder="Templates")
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-key")
 
+# With REDIS_URL set, keep session data server-side so the browser only
+# carries a short session id; chat histories are stored there as well
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_TTL = timedelta(hours=1)
+_redis = None
+if REDIS_URL:
+    import redis
+    from flask_session import Session
+
+    _redis = redis.Redis.from_url(REDIS_URL)
+    app.config.update(
+        SESSION_TYPE="redis",
+        SESSION_REDIS=_redis,
+        PERMANENT_SESSION_LIFETIME=SESSION_TTL,
+    )
+    Session(app)
+
 # Serve favicon.ico explicitly (some browsers still request this even with PNG favicon links)
 @app.get("/favicon.ico")
 def favicon():
     return send_from_directory(app.static_folder, "glow_round_favicon.png")
 
 SYSTEM_PROMPT = "Be concise, friendly, and helpful. If unsure, say so briefly."
+# Shared by every request; the SDK only serializes it, never mutates it
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
 HISTORY_MAX = 6
-FAST_TRIGGER = {"hi", "hello", "hey", "yo", "sup", "howdy"}
+FAST_TRIGGER = frozenset({"hi", "hello", "hey", "yo", "sup", "howdy"})
+FAST_TRIGGER_MAXLEN = max(map(len, FAST_TRIGGER))
+HISTORY_SESSIONS_MAX = 10000
+REPLY_CACHE_MAX = 2048
+REPLY_CACHE_TTL = 600  # seconds
+# Required in the X-Admin-Token header by /cache/clear; unset disables the route
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Token frames are coalesced and written once this many bytes or seconds pile up
+SSE_FLUSH_BYTES = 2048
+SSE_FLUSH_SECS = 0.004
+_SSE_DONE = b"data: [DONE]\n\n"
+# Comment frame sent while Cohere is silent, so proxies keep the stream open
+SSE_PING_SECS = 15
+_SSE_PING = b": ping\n\n"
+_STREAM_END = object()
+COHERE_MAX_INFLIGHT = int(os.getenv("COHERE_MAX_INFLIGHT", "8"))
+COHERE_RPM = int(os.getenv("COHERE_RPM", "0"))  # 0 = no per-minute cap
+
+# Bound upstream load: past these limits callers get a 429 straight away
+# instead of queueing into Cohere rate limits and retries
+_cohere_slots = threading.BoundedSemaphore(COHERE_MAX_INFLIGHT)
+_rpm_window = deque()
+_rpm_lock = threading.Lock()
+
+class CohereBusy(Exception):
+    pass
+
+def _acquire_cohere_slot():
+    """Claim an in-flight slot (and a request-per-minute token); False means busy."""
+    if not _cohere_slots.acquire(timeout=0.05):
+        return False
+    if COHERE_RPM:
+        now = time.monotonic()
+        with _rpm_lock:
+            while _rpm_window and now - _rpm_window[0] >= 60:
+                _rpm_window.popleft()
+            if len(_rpm_window) >= COHERE_RPM:
+                _cohere_slots.release()
+                return False
+            _rpm_window.append(now)
+    return True
+
+class ModelHost:
+    """
+    Collects chat requests from all sessions on one queue. A background thread
+    drains whatever arrives within a short window and fans the batch out to a
+    shared thread pool, resolving each caller's Future with the reply text.
+    """
+
+    def __init__(self, max_batch_size=8, batch_delay=0.005, max_workers=8):
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, messages):
+        future = Future()
+        self._queue.put((messages, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            for messages, future in batch:
+                self._pool.submit(self._call, messages, future)
+
+    def _call(self, messages, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            res = co.chat(model=COHERE_MODEL, messages=messages, **CO_OPTS, request_options=REQ_OPTS)
+            reply = res.message.content[0].text if res and res.message and res.message.content else "(no reply)"
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(reply)
+
+model_host = ModelHost()
+
+# Chat history lives server-side, keyed by a session id in the cookie. A
+# streamed reply only exists after the response headers (and so any cookie
+# update) have gone out, so it could not be saved into the session itself.
+# With Redis each history is a list under its own key, shared by every worker
+# and kept across restarts; otherwise an in-process LRU holds it.
+_histories = LRUCache(maxsize=HISTORY_SESSIONS_MAX)
+_histories_lock = threading.Lock()
+
+def _history_key(sid):
+    return f"chat:history:{sid}"
+
+def _session_id():
+    sid = session.get("sid")
+    if sid is None:
+        sid = session["sid"] = uuid.uuid4().hex
+    return sid
+
+def _session_messages(sid, user_text):
+    if _redis is not None:
+        history = [orjson.loads(m) for m in _redis.lrange(_history_key(sid), 0, -1)]
+        return _build_messages(history, user_text)
+    # Built under the lock straight from the stored deque, so no copy of the
+    # history is needed to guard against a concurrent append
+    with _histories_lock:
+        return _build_messages(_histories.get(sid, ()), user_text)
+
+def _append_turn(sid, user_text, reply):
+    """Write only the new turn; the deque's maxlen (or LTRIM) drops the oldest messages."""
+    if _redis is not None:
+        key = _history_key(sid)
+        pipe = _redis.pipeline()
+        pipe.rpush(
+            key,
+            orjson.dumps({"role": "user", "content": user_text}),
+            orjson.dumps({"role": "assistant", "content": reply}),
+        )
+        pipe.ltrim(key, -HISTORY_MAX, -1)
+        pipe.expire(key, SESSION_TTL)
+        pipe.execute()
+        return
+    with _histories_lock:
+        history = _histories.get(sid)
+        if history is None:
+            history = _histories[sid] = deque(maxlen=HISTORY_MAX)
+        history.append({"role": "user", "content": user_text})
+        history.append({"role": "assistant", "content": reply})
+
+def _history_len(sid):
+    if _redis is not None:
+        return _redis.llen(_history_key(sid))
+    with _histories_lock:
+        return len(_histories.get(sid, ()))
+
+def _drop_history(sid):
+    if _redis is not None:
+        _redis.delete(_history_key(sid))
+        return
+    with _histories_lock:
+        _histories.pop(sid, None)
+
+def _build_messages(history, user_text):
+    """Cohere message list for this turn; greetings skip the history."""
+    # Length check first, so long messages never pay for a lowercased copy
+    if len(user_text) <= FAST_TRIGGER_MAXLEN and user_text.lower() in FAST_TRIGGER:
+        history = ()
+    return [SYSTEM_MSG, *history, {"role": "user", "content": user_text}]
+
+# Replies for exact conversations seen recently; a repeat skips Cohere and
+# never takes a slot. Entries expire so stale answers don't live forever.
+_reply_cache = TTLCache(maxsize=REPLY_CACHE_MAX, ttl=REPLY_CACHE_TTL)
+_reply_cache_lock = threading.Lock()
+
+def _reply_key(messages):
+    """16-byte digest of the whole conversation, so keys stay small however long it gets."""
+    return hashlib.blake2b(orjson.dumps(messages), digest_size=16).digest()
+
+def _llm_reply(messages):
+    if not _acquire_cohere_slot():
+        raise CohereBusy()
+    future = model_host.submit(messages)
+    # Released when the pool finishes the call, not when this caller stops
+    # waiting, so slow upstream calls keep counting against the cap
+    future.add_done_callback(lambda _: _cohere_slots.release())
+    return future.result(timeout=CHAT_TIMEOUT)
+
+def ojson(obj, status=200):
+    """JSON response encoded straight with orjson; every route responds through this."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def _sse(obj):
+    return b"data: " + orjson.dumps(obj) + b"\n\n"
+
+def _pump_stream(messages, out, stop):
+    """Feed Cohere text deltas into `out`, ending with _STREAM_END or the exception."""
+    try:
+        stream = co.chat_stream(model=COHERE_MODEL, messages=messages, **CO_OPTS, request_options=REQ_OPTS)
+        # closing() shuts the SDK generator, and with it the upstream HTTP
+        # response, as soon as the client is gone instead of reading on
+        with closing(stream):
+            for event in stream:
+                if stop.is_set():
+                    return
+                if event.type == "content-delta":
+                    out.put(event.delta.message.content.text)
+    except Exception as e:
+        out.put(e)
+    else:
+        out.put(_STREAM_END)
+
+def _read_user_text():
+    payload = request.get_json(silent=True) or {}
+    return (payload.get("message") or "").strip()
+
+# The page has no per-request data, so render it once and serve the bytes
+_index_html = None
 
 @app.get("/")
 def index():
-    session.setdefault("messages", [])
-    return render_template("index.html")
+    global _index_html
+    if _index_html is None or app.debug:
+        _index_html = render_template("index.html").encode()
+    return Response(_index_html, mimetype="text/html", headers={"Cache-Control": "public, max-age=300"})
 
 @app.post("/chat")
 def chat():
-    payload = request.get_json(silent=True) or {}
-    user_text = (payload.get("message") or "").strip()
+    user_text = _read_user_text()
     if not user_text:
-        return jsonify({"ok": False, "error": "Empty message"}), 400
+        return ojson({"ok": False, "error": "Empty message"}, 400)
     if not COHERE_API_KEY:
-        return jsonify({"ok": False, "error": "Missing COHERE_API_KEY"}), 500
+        return ojson({"ok": False, "error": "Missing COHERE_API_KEY"}, 500)
 
-    history = session.get("messages", [])
-    if len(history) > HISTORY_MAX:
-        history = history[-HISTORY_MAX:]
+    sid = _session_id()
+    # Stored already in Cohere message format, so no per-turn role mapping
+    messages = _session_messages(sid, user_text)
 
-    if user_text.lower() in FAST_TRIGGER:
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_text},
-        ]
-    else:
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        for m in history:
-            role = "assistant" if m["role"] == "bot" else "user"
-            messages.append({"role": role, "content": m["text"]})
-        messages.append({"role": "user", "content": user_text})
+    key = _reply_key(messages)
+    with _reply_cache_lock:
+        reply = _reply_cache.get(key)
+    if reply is not None:
+        _append_turn(sid, user_text, reply)
+        return ojson({"ok": True, "reply": reply, "cached": True})
 
     try:
-        res = co.chat(model="command-a-03-2025", messages=messages)
-        reply = res.message.content[0].text if res and res.message and res.message.content else "(no reply)"
+        reply = _llm_reply(messages)
+    except CohereBusy:
+        return ojson({"ok": False, "error": "busy"}, 429)
+    except FutureTimeout:
+        log.warning("chat timed out after %ss", CHAT_TIMEOUT)
+        return ojson({"ok": False, "error": "timeout"}, 504)
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+        log.exception("chat failed")
+        return ojson({"ok": False, "error": str(e)}, 500)
+
+    with _reply_cache_lock:
+        _reply_cache[key] = reply
+    _append_turn(sid, user_text, reply)
+
+    return ojson({"ok": True, "reply": reply})
 
-    history.append({"role": "user", "text": user_text})
-    history.append({"role": "bot", "text": reply})
-    session["messages"] = history[-HISTORY_MAX:]
+@app.post("/chat_stream")
+def chat_stream():
+    user_text = _read_user_text()
+    if not user_text:
+        return ojson({"ok": False, "error": "Empty message"}, 400)
+    if not COHERE_API_KEY:
+        return ojson({"ok": False, "error": "Missing COHERE_API_KEY"}, 500)
+
+    sid = _session_id()
+    messages = _session_messages(sid, user_text)
 
-    return jsonify({"ok": True, "reply": reply})
+    def generate():
+        # The reply is kept as UTF-8 in one growing buffer and decoded once
+        reply_buf = bytearray()
+        buf = bytearray()
+        last = time.monotonic()
+        # Cohere is read on a helper thread so this loop can wake up and ping
+        tokens = queue.Queue()
+        stop = threading.Event()
+        threading.Thread(target=_pump_stream, args=(messages, tokens, stop), daemon=True).start()
+        try:
+            while True:
+                # Pending frames only wait out the rest of the flush window;
+                # an idle stream waits for the next ping instead
+                if buf:
+                    wait = max(0.0, last + SSE_FLUSH_SECS - time.monotonic())
+                else:
+                    wait = SSE_PING_SECS
+                try:
+                    item = tokens.get(timeout=wait)
+                except queue.Empty:
+                    if not buf:
+                        buf += _SSE_PING
+                    item = None
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    # Raised on the pump thread; pass it along for the traceback
+                    log.error("chat stream failed", exc_info=item)
+                    buf += _sse({"error": str(item)})
+                    yield bytes(buf)
+                    return
+                if item is not None:
+                    reply_buf += item.encode()
+                    buf += _sse({"token": item})
+                now = time.monotonic()
+                if item is None or len(buf) >= SSE_FLUSH_BYTES or now - last > SSE_FLUSH_SECS:
+                    yield bytes(buf)
+                    buf.clear()
+                    last = now
+        finally:
+            # Client gone or stream over: let the helper thread stop reading
+            stop.set()
+
+        _append_turn(sid, user_text, reply_buf.decode() or "(no reply)")
+        buf += _SSE_DONE
+        yield bytes(buf)
+
+    if not _acquire_cohere_slot():
+        return ojson({"ok": False, "error": "busy"}, 429)
+    resp = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Released once Werkzeug closes the response, however the stream ended
+    resp.call_on_close(_cohere_slots.release)
+    return resp
 
 @app.post("/reset")
 def reset():
-    session.pop("messages", None)
-    return jsonify({"ok": True})
+    sid = session.pop("sid", None)
+    if sid is not None:
+        _drop_history(sid)
+    return ojson({"ok": True})
+
+@app.post("/cache/clear")
+def cache_clear():
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        return ojson({"ok": False, "error": "forbidden"}, 403)
+    with _reply_cache_lock:
+        _reply_cache.clear()
+    return ojson({"ok": True})
 
 @app.get("/health")
 def health():
-    return jsonify({"status": "ok", "backend": "cohere", "session_len": len(session.get("messages", []))})
+    sid = session.get("sid")
+    session_len = _history_len(sid) if sid is not None else 0
+    return ojson({"status": "ok", "backend": "cohere", "session_len": session_len})
 
 # Render runs gunicorn app:app
 if __name__ == "__main__":